@@ -107,6 +107,23 @@ def confirm_config_name(name):
 
 _filename_sanitize_unicode = frozenset(('\\', '|', '?', '*', '<',        # no2to3
     '"', ':', '>', '+', '/') + tuple(map(codepoint_to_chr, range(32))))  # no2to3
+# The characters, apart from the control characters above, that are
+# whitespace according to the re module
+_filename_whitespace = {cp: ' ' for cp in (
+    0x85, 0xa0, 0x1680, 0x2000, 0x2001, 0x2002, 0x2003, 0x2004, 0x2005, 0x2006,
+    0x2007, 0x2008, 0x2009, 0x200a, 0x2028, 0x2029, 0x202f, 0x205f, 0x3000)}
+_filename_sanitize_tables = {}
+
+
+def _filename_sanitize_table(substitute):
+    ans = _filename_sanitize_tables.get(substitute)
+    if ans is None:
+        ans = dict(_filename_whitespace)
+        sub = re.sub(r'\s', ' ', substitute)
+        for c in _filename_sanitize_unicode:
+            ans[ord(c)] = sub
+        _filename_sanitize_tables[substitute] = ans
+    return ans
 
 
 def sanitize_file_name(name, substitute='_'):
@@ -121,9 +138,8 @@ def sanitize_file_name(name, substitute='_'):
         name = name.decode(filesystem_encoding, 'replace')
     if isbytestring(substitute):
         substitute = substitute.decode(filesystem_encoding, 'replace')
-    chars = (substitute if c in _filename_sanitize_unicode else c for c in name)
-    one = ''.join(chars)
-    one = re.sub(r'\s', ' ', one).strip()
+    # Replace invalid characters and normalize whitespace in a single pass
+    one = name.translate(_filename_sanitize_table(substitute)).strip()
     bname, ext = os.path.splitext(one)
     one = re.sub(r'^\.+$', '_', bname)
     one = one.replace('..', substitute)
@@ -1361,9 +1361,7 @@ class Cache(object):
             path_changed = True
             if not mi.authors:
                 mi.authors = [_('Unknown')]
-            authors = []
-            for a in mi.authors:
-                authors += string_to_authors(a)
+            authors = [x for a in mi.authors for x in string_to_authors(a)]
             set_field('authors', authors)
             authors_changed = True
 
@@ -392,8 +392,8 @@ class LibraryDatabase(object):
             self.data.books_added((book_id,))
         return book_id
 
-    def add_format(self, index, fmt, stream, index_is_id=False, path=None, notify=True, replace=True, copy_function=None):
-        ''' path and copy_function are ignored by the new API '''
+    def add_format(self, index, fmt, stream, index_is_id=False, path=None, notify=True, replace=True, copy_function=None, commit=True):
+        ''' path, copy_function and commit are ignored by the new API '''
         book_id = index if index_is_id else self.id(index)
         ret = self.new_api.add_format(book_id, fmt, stream, replace=replace, run_hooks=False, dbapi=self)
         self.notify('metadata', [book_id])
@@ -552,6 +552,19 @@ class LibraryDatabase(object):
         finally:
             self.notify('metadata', [book_id])
 
+    def set_many(self, edits, allow_case_change=False):
+        field_map = {}
+        for index, field, val in edits:
+            field_map.setdefault(field, {})[self.id(index)] = val
+        book_ids, ans = set(), set()
+        try:
+            for field, book_id_val_map in iteritems(field_map):
+                book_ids |= set(book_id_val_map)
+                ans |= self.new_api.set_field(field, book_id_val_map, allow_case_change=allow_case_change)
+            return ans
+        finally:
+            self.notify('metadata', list(book_ids))
+
     def set_identifier(self, book_id, typ, val, notify=True, commit=True):
         with self.new_api.write_lock:
             identifiers = self.new_api._field_for('identifiers', book_id)
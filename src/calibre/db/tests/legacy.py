@@ -430,6 +430,64 @@ class LegacyTest(BaseTest):
         old.close()
     # }}}
 
+    def test_legacy_old_database_import(self):  # {{{
+        'Test reading and importing a pre 0.4.0 database'
+        import os, sqlite3
+        from calibre.library.database import LibraryDatabase, _connect
+        path = os.path.join(self.mkdtemp(), 'old.db')
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE books_meta(id INTEGER PRIMARY KEY, title TEXT, authors TEXT, publisher TEXT,
+                size INTEGER, tags TEXT, date DATE, comments TEXT, rating INTEGER);
+            CREATE TABLE books_cover(id INTEGER, uncompressed_size INTEGER, data BLOB);
+            CREATE TABLE books_data(id INTEGER, extension TEXT, uncompressed_size INTEGER, data BLOB);
+        ''')
+        ts = '2008-01-01 10:00:00'
+        conn.executemany('INSERT INTO books_meta VALUES (?,?,?,?,?,?,?,?,?)', [
+            (1, 'One', 'Author One & Author Two', 'Pub', 0, 'a, b', ts, 'comments', 3),
+            (2, 'Two', None, None, 0, None, ts, None, None),
+            (4, 'Four', 'Author One', 'Pub', 0, 'b', ts, None, 5),
+        ])
+        # Covers and formats with no id, or for ids with no book, must be skipped
+        conn.executemany('INSERT INTO books_cover VALUES (?,?,?)', [
+            (None, 2, b'cn'), (1, 2, b'c1'), (3, 2, b'c3'), (4, 2, b'c4')])
+        conn.executemany('INSERT INTO books_data VALUES (?,?,?,?)', [
+            (None, 'txt', 2, b'fn'), (0, 'txt', 2, b'f0'), (1, 'lrf', 2, b'f1'), (1, 'txt', 2, b'f2'), (3, 'txt', 2, b'f3'), (4, 'rtf', 2, b'f4')])
+        conn.commit()
+        conn.close()
+
+        books = list(LibraryDatabase.books_in_old_database(path))
+        self.assertEqual([(m['title'], c, set(f)) for m, c, f in books], [
+            ('One', {'uncompressed_size':2, 'data':b'c1'}, {'lrf', 'txt'}),
+            ('Two', {}, set()),
+            ('Four', {'uncompressed_size':2, 'data':b'c4'}, {'rtf'}),
+        ])
+        self.assertEqual(books[0][2]['txt'], {'uncompressed_size':2, 'data':b'f2'})
+        self.assertEqual(books[0][0]['tags'], 'a, b')
+        self.assertEqual(books[2][0]['rating'], 5)
+
+        conn = _connect(os.path.join(os.path.dirname(path), 'new.db'))
+        LibraryDatabase.create_version1(conn)
+        LibraryDatabase.upgrade_version1(conn)
+        progress = []
+        LibraryDatabase.import_old_database(path, conn, progress.append)
+        self.assertEqual(progress, [1, 2, 3])
+        self.assertEqual(conn.get('SELECT title FROM books ORDER BY id'), [['One'], ['Two'], ['Four']])
+        self.assertEqual(conn.get('''SELECT books.title, authors.name FROM books_authors_link
+            JOIN books ON books.id=book JOIN authors ON authors.id=author ORDER BY books.id, authors.name'''), [
+                ['One', 'Author One'], ['One', 'Author Two'], ['Two', 'Unknown'], ['Four', 'Author One']])
+        self.assertEqual(conn.get('''SELECT books.title, tags.name FROM books_tags_link
+            JOIN books ON books.id=book JOIN tags ON tags.id=tag ORDER BY books.id, tags.name'''), [
+                ['One', 'a'], ['One', 'b'], ['Four', 'b']])
+        self.assertEqual(conn.get('SELECT COUNT(*) FROM publishers', all=False), 1)
+        self.assertEqual(conn.get('''SELECT ratings.rating FROM books_ratings_link
+            JOIN ratings ON ratings.id=books_ratings_link.rating ORDER BY book'''), [[6], [10]])
+        self.assertEqual(conn.get('SELECT data FROM covers ORDER BY book'), [[b'c1'], [b'c4']])
+        self.assertEqual(conn.get('SELECT format, data FROM data ORDER BY book, format'), [
+            ['lrf', b'f1'], ['txt', b'f2'], ['rtf', b'f4']])
+        conn.close()
+    # }}}
+
     def test_legacy_coverage(self):  # {{{
         ' Check that the emulation of the legacy interface is (almost) total '
         cl = self.cloned_library
@@ -458,7 +516,8 @@ class LegacyTest(BaseTest):
             'import_old_database', 'dirtied_lock', 'dirtied_cache', 'dirty_books_referencing',
             'windows_check_if_files_in_use', 'get_metadata_for_dump', 'get_a_dirtied_book', 'dirtied_sequence',
             'format_filename_cache', 'format_metadata_cache', 'filter', 'create_version1', 'normpath', 'custom_data_adapters',
-            'custom_table_names', 'custom_columns_in_meta', 'custom_tables',
+            'custom_table_names', 'custom_columns_in_meta', 'custom_tables', 'name_parts_cache', '_name_parts',
+            'categories_cache', 'CATEGORIES_CACHE_SIZE', '_get_categories',
         }
         SKIP_ARGSPEC = {
             '__init__',
@@ -656,6 +715,26 @@ class LegacyTest(BaseTest):
         ))
         db.close()
 
+        ndb = self.init_legacy(self.cloned_library)
+        db = self.init_old(self.cloned_library)
+        run_funcs(self, db, ndb, (
+            ('-set_many', [
+                (0, 'title', 'newtitle'), (1, 'title', 'another title'),
+                (0, 'tags', 't1,t2,tag one'), (2, 'tags', 'T1'),
+                (0, 'authors', 'author one & Author Two'), (1, 'authors', 'author three'),
+                (2, 'rating', 3.2), (1, 'publisher', 'publisher one'), (2, 'publisher', None),
+            ], True),
+            (db.refresh,),
+            ('title', 0), ('title', 1), ('title', 2),
+            ('rating', 0), ('rating', 1), ('rating', 2),
+            ('#tags', 0), ('#tags', 1), ('#tags', 2),
+            ('@all_tags',),
+            ('authors', 0), ('authors', 1), ('authors', 2),
+            ('author_sort', 0), ('author_sort', 1), ('author_sort', 2),
+            ('publisher', 0), ('publisher', 1), ('publisher', 2),
+        ))
+        db.close()
+
         ndb = self.init_legacy(self.cloned_library)
         db = self.init_old(self.cloned_library)
         run_funcs(self, db, ndb, (
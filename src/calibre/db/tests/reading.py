@@ -420,6 +420,61 @@ class ReadingTest(BaseTest):
 
     # }}}
 
+    def test_get_categories_cache(self):  # {{{
+        'Check that the old backend invalidates and copies cached categories'
+        import os, sqlite3
+        from calibre.library.database2 import LibraryDatabase2
+        old = LibraryDatabase2(self.library_path)
+        names = lambda cats: [t.name for t in cats['tags']]
+        counts = lambda cats: [t.count for t in cats['tags']]
+        calls = []
+        compute = old._get_categories
+
+        def _get_categories(*args, **kwargs):
+            calls.append(args)
+            return compute(*args, **kwargs)
+        old._get_categories = _get_categories
+
+        cats = old.get_categories()
+        before = names(cats), counts(cats)
+        self.assertIn('Tag One', before[0])
+        # Changes made by the caller must not leak into later results
+        cats['tags'][0].count = -1
+        del cats['tags'][1:]
+        cats = old.get_categories()
+        self.assertEqual((names(cats), counts(cats)), before)
+        self.assertEqual(len(calls), 1, 'Unchanged categories were not cached')
+
+        # A write through this connection
+        old.set_tags(1, ['Cache Tag'], append=True)
+        self.assertIn('Cache Tag', names(old.get_categories()))
+        self.assertEqual(len(calls), 2)
+
+        # A write by another process. The timestamp is changed explicitly, to
+        # not depend on the resolution of the file system timestamps.
+        st = os.stat(old.dbpath)
+        conn = sqlite3.connect(old.dbpath)
+        conn.execute("UPDATE tags SET name='Other Tag' WHERE name='Cache Tag'")
+        conn.commit()
+        conn.close()
+        os.utime(old.dbpath, (st.st_atime, st.st_mtime + 10))
+        cats = old.get_categories()
+        self.assertIn('Other Tag', names(cats))
+        self.assertNotIn('Cache Tag', names(cats))
+        self.assertIsInstance(cats['tags'][0].id_set, frozenset)
+
+        # Uncommitted writes, which do not change the modification time
+        fmts = lambda: {t.name:t.count for t in old.get_categories()['formats']}
+        self.assertEqual(fmts(), {'FMT1':2, 'FMT2':1})
+        old.add_format(3, 'FMT3', BytesIO(b'book3fmt3'), index_is_id=True, commit=False)
+        self.assertEqual(fmts(), {'FMT1':2, 'FMT2':1, 'FMT3':1})
+        old.remove_format(1, 'FMT2', index_is_id=True, commit=False)
+        self.assertEqual(fmts(), {'FMT1':2, 'FMT3':1})
+        old.delete_book(2, commit=False)
+        self.assertEqual(fmts(), {'FMT1':1, 'FMT3':1})
+        old.conn.close()
+    # }}}
+
     def test_get_formats(self):  # {{{
         'Test reading ebook formats using the format() method'
         from calibre.library.database2 import LibraryDatabase2
@@ -485,6 +485,7 @@ class CoverView(QWidget):  # {{{
         self.pixmap = self.default_pixmap
         self.pwidth = self.pheight = None
         self.data = {}
+        self.scaled_pixmap_key, self.scaled_pixmap = None, None
 
         self.do_layout()
 
@@ -544,9 +545,7 @@ class CoverView(QWidget):  # {{{
             dpr = self.devicePixelRatioF()
         except AttributeError:
             dpr = self.devicePixelRatio()
-        spmap = self.pixmap.scaled(target.size() * dpr, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-        spmap.setDevicePixelRatio(dpr)
-        p.drawPixmap(target, spmap)
+        p.drawPixmap(target, self.scaled_pixmap_for(target.size() * dpr, dpr))
         if gprefs['bd_overlay_cover_size']:
             sztgt = target.adjusted(0, 0, 0, -4)
             f = p.font()
@@ -560,6 +559,16 @@ class CoverView(QWidget):  # {{{
             p.drawText(sztgt, flags, sz)
         p.end()
 
+    def scaled_pixmap_for(self, size, dpr):
+        # Smooth scaling a full size cover is expensive and paint events are
+        # frequent, so keep the last scaled pixmap around
+        key = self.pixmap.cacheKey(), size.width(), size.height(), dpr
+        if key != self.scaled_pixmap_key:
+            spmap = self.pixmap.scaled(size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            spmap.setDevicePixelRatio(dpr)
+            self.scaled_pixmap_key, self.scaled_pixmap = key, spmap
+        return self.scaled_pixmap
+
     current_pixmap_size = pyqtProperty('QSize',
             fget=lambda self: self._current_pixmap_size,
             fset=setCurrentPixmapSize
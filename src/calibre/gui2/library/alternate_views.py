@@ -9,10 +9,11 @@ import itertools
 import math
 import operator
 import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from PyQt5.Qt import (
     QAbstractItemView, QApplication, QBuffer, QByteArray, QColor, QDrag,
-    QEasingCurve, QEvent, QFont, QHelpEvent, QIcon, QImage, QItemSelection,
+    QEasingCurve, QEvent, QFont, QHelpEvent, QIcon, QImage, QImageReader, QItemSelection,
     QItemSelectionModel, QListView, QMimeData, QModelIndex, QPainter, QPixmap,
     QPoint, QPropertyAnimation, QRect, QSize, QStyledItemDelegate, QPalette,
     QStyleOptionViewItem, Qt, QTableView, QTimer, QToolTip, QTreeView, QUrl,
@@ -32,10 +33,12 @@ from calibre.gui2.pin_columns import PinContainer
 from calibre.utils import join_with_timeout
 from calibre.utils.config import prefs, tweaks
 from polyglot.builtins import itervalues, range, unicode_type
-from polyglot.queue import LifoQueue
+from polyglot.queue import Empty, LifoQueue
 
 CM_TO_INCH = 0.393701
 CACHE_FORMAT = 'PPM'
+RENDER_IO_THREADS = 4
+RENDER_BATCH_SIZE = 16
 
 
 def auto_height(widget):
@@ -83,6 +86,24 @@ def image_to_data(image):  # {{{
     ret = ba.data()
     buf.close()
     return ret
+
+
+def read_scaled_image(data, fmt, width, height):
+    '''
+    Decode the image in data, shrinking it to fit within width x height.
+    Decoders such as the JPEG one can decode directly at a reduced size,
+    which is much faster than decoding the full image and scaling it.
+    '''
+    buf = QBuffer()
+    buf.setData(data)
+    buf.open(QIODevice.OpenModeFlag.ReadOnly)
+    r = QImageReader(buf, fmt.encode('ascii'))
+    sz = r.size()
+    if sz.isValid():
+        scaled, nwidth, nheight = fit_image(sz.width(), sz.height(), width, height)
+        if scaled:
+            r.setScaledSize(QSize(nwidth, nheight))
+    return r.read()
 # }}}
 
 # Drag 'n Drop {{{
@@ -873,27 +894,37 @@ class GridView(QListView):
 
     def render_covers(self):
         q = self.delegate.render_queue
-        while True:
-            book_id = q.get()
-            try:
-                if book_id is None:
-                    return
-                if self.ignore_render_requests.is_set():
-                    continue
+        # Covers are read from disk in a small pool of threads so that several
+        # reads are in flight at once, decoding and scaling happens in this
+        # thread
+        with ThreadPoolExecutor(max_workers=RENDER_IO_THREADS) as pool:
+            while True:
+                book_ids = [q.get()]
+                while len(book_ids) < RENDER_BATCH_SIZE:
+                    try:
+                        book_ids.append(q.get_nowait())
+                    except Empty:
+                        break
                 try:
-                    self.render_cover(book_id)
-                except:
-                    import traceback
-                    traceback.print_exc()
-            finally:
-                q.task_done()
-
-    def render_cover(self, book_id):
-        if self.ignore_render_requests.is_set():
-            return
-        dpr = self.device_pixel_ratio
-        page_width = int(dpr * self.delegate.cover_size.width())
-        page_height = int(dpr * self.delegate.cover_size.height())
+                    if None in book_ids:
+                        return
+                    if self.ignore_render_requests.is_set():
+                        continue
+                    loads = [(book_id, pool.submit(self.load_cover, book_id))
+                             for book_id in dict.fromkeys(book_ids)]
+                    for book_id, load in loads:
+                        if self.ignore_render_requests.is_set():
+                            break
+                        try:
+                            self.render_cover(book_id, *load.result())
+                        except:
+                            import traceback
+                            traceback.print_exc()
+                finally:
+                    for i in range(len(book_ids)):
+                        q.task_done()
+
+    def load_cover(self, book_id):
         tcdata, timestamp = self.thumbnail_cache[book_id]
         use_cache = False
         if timestamp is None:
@@ -905,10 +936,20 @@ class GridView(QListView):
                 # The cached cover is fresh
                 cdata = tcdata
                 use_cache = True
+        return has_cover, cdata, tcdata, timestamp, use_cache
 
+    def render_cover(self, book_id, has_cover, cdata, tcdata, timestamp, use_cache):
+        if self.ignore_render_requests.is_set():
+            return
+        dpr = self.device_pixel_ratio
+        page_width = int(dpr * self.delegate.cover_size.width())
+        page_height = int(dpr * self.delegate.cover_size.height())
         if has_cover:
-            p = QImage()
-            p.loadFromData(cdata, CACHE_FORMAT if cdata is tcdata else 'JPEG')
+            if cdata is tcdata:
+                p = QImage()
+                p.loadFromData(cdata, CACHE_FORMAT)
+            else:
+                p = read_scaled_image(cdata, 'JPEG', page_width, page_height)
             p.setDevicePixelRatio(dpr)
             if p.isNull() and cdata is tcdata:
                 # Invalid image in cache
@@ -977,6 +1018,8 @@ class GridView(QListView):
             except RuntimeError:
                 print('Cover rendering thread is stuck!')
             finally:
+                self.delegate.cover_cache.set_database(newdb)
+                self.thumbnail_cache.set_database(newdb)
                 self.ignore_render_requests.clear()
         else:
             self.delegate.cover_cache.clear()
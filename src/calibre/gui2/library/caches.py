@@ -33,10 +33,21 @@ class CoverCache(dict):
         self.limit = limit
         self.pixmap_staging = []
         self.gui_thread = current_thread()
+        self.library_id = None
+
+    def set_database(self, db):
+        # Book ids are only unique within a library, so drop all cached covers
+        # when switching to a different library
+        library_id = db.library_id
+        if library_id != self.library_id:
+            self.clear()
+            self.library_id = library_id
 
     def clear_staging(self):
         ' Must be called in the GUI thread '
-        self.pixmap_staging = []
+        if self.pixmap_staging:
+            with self.lock:
+                self.pixmap_staging = []
 
     def invalidate(self, book_ids):
         with self.lock:
@@ -50,15 +61,25 @@ class CoverCache(dict):
 
     def __getitem__(self, key):
         ' Must be called in the GUI thread '
-        with self.lock:
-            self.clear_staging()
-            ans = self.items.pop(key, False)  # pop() so that item is moved to the top
-            if ans is not False:
-                if isinstance(ans, QImage):
-                    # Convert to QPixmap, since rendering QPixmap is much
-                    # faster
-                    ans = QPixmap.fromImage(ans)
-                self.items[key] = ans
+        self.clear_staging()
+        ans = self.items.get(key, False)
+        if isinstance(ans, QImage):
+            with self.lock:
+                ans = self.items.pop(key, False)  # pop() so that item is moved to the top
+                if ans is not False:
+                    if isinstance(ans, QImage):
+                        # Convert to QPixmap, since rendering QPixmap is much
+                        # faster
+                        ans = QPixmap.fromImage(ans)
+                    self.items[key] = ans
+        elif ans is not False:
+            # Already converted, so the lock is not needed. Every operation on
+            # self.items is a single call into the C implementation of
+            # OrderedDict, which is atomic with respect to the render thread.
+            try:
+                self.items.move_to_end(key)
+            except KeyError:
+                pass  # Removed by the render thread in the meantime
 
         return ans
 
@@ -67,12 +88,12 @@ class CoverCache(dict):
             self._pop(key)  # pop() so that item is moved to the top
             self.items[key] = val
             if len(self.items) > self.limit:
-                del self.items[next(iter(self.items))]
+                self.items.popitem(last=False)
 
     def clear(self):
         with self.lock:
             if current_thread() is not self.gui_thread:
-                pixmaps = (x for x in itervalues(self.items) if isinstance(x, QPixmap))
+                pixmaps = (x for x in tuple(itervalues(self.items)) if isinstance(x, QPixmap))
                 self.pixmap_staging.extend(pixmaps)
             self.items.clear()
 
@@ -84,6 +105,6 @@ class CoverCache(dict):
             self.limit = limit
             if len(self.items) > self.limit:
                 extra = len(self.items) - self.limit
-                remove = tuple(self)[:extra]
+                remove = tuple(self.items)[:extra]
                 for k in remove:
                     self._pop(k)
@@ -156,6 +156,26 @@ def force_to_bool(val):
     return val
 
 
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER, which defaults to 999
+SQL_IN_CHUNK_SIZE = 500
+
+
+def fetch_meta_rows(db, ids):
+    '''
+    Return a mapping of book id to its row in the meta2 view, using one query
+    per chunk of ids rather than one query per id. Ids not present in the
+    database are not in the mapping.
+    '''
+    ids = tuple(ids)
+    ans = {}
+    for i in range(0, len(ids), SQL_IN_CHUNK_SIZE):
+        chunk = ids[i:i+SQL_IN_CHUNK_SIZE]
+        for r in db.conn.get('SELECT * FROM meta2 WHERE id IN (%s)' % (
+                ','.join(repeat('?', len(chunk)))), chunk):
+            ans[r[0]] = r
+    return ans
+
+
 class CacheRow(list):  # {{{
 
     def __init__(self, db, composites, datetimes, val, series_col, series_sort_col):
@@ -231,8 +251,10 @@ class ResultCache(SearchQueryParser):  # {{{
                 self.datetimes.add(field_metadata[key]['rec_index'])
         self.series_col = field_metadata['series']['rec_index']
         self.series_sort_col = field_metadata['series_sort']['rec_index']
-        self._data = []
+        self._data = {}
         self._map = self._map_filtered = []
+        # The fields _map was last sorted on, reset whenever the data changes
+        self._last_sort = None
         self.first_sort = True
         self.search_restriction = self.base_restriction = ''
         self.base_restriction_name = self.search_restriction_name = ''
@@ -266,9 +288,8 @@ class ResultCache(SearchQueryParser):  # {{{
             yield self._data[id]
 
     def iterall(self):
-        for x in self._data:
-            if x is not None:
-                yield x
+        for x in itervalues(self._data):
+            yield x
 
     def iterallids(self):
         idx = self.FIELD_MAP['id']
@@ -278,7 +299,7 @@ class ResultCache(SearchQueryParser):  # {{{
     # Search functions {{{
 
     def universal_set(self):
-        return {i[0] for i in self._data if i is not None}
+        return set(self._data)
 
     def change_search_locations(self, locations):
         self.sqp_change_locations(locations)
@@ -356,7 +377,7 @@ class ResultCache(SearchQueryParser):  # {{{
 
         if query == 'false':
             for id_ in candidates:
-                item = self._data[id_]
+                item = self._data.get(id_)
                 if item is None:
                     continue
                 v = item[loc]
@@ -367,7 +388,7 @@ class ResultCache(SearchQueryParser):  # {{{
             return matches
         if query == 'true':
             for id_ in candidates:
-                item = self._data[id_]
+                item = self._data.get(id_)
                 if item is None:
                     continue
                 v = item[loc]
@@ -411,7 +432,7 @@ class ResultCache(SearchQueryParser):  # {{{
             else:
                 field_count = query.count('/') + 1
         for id_ in candidates:
-            item = self._data[id_]
+            item = self._data.get(id_)
             if item is None or item[loc] is None:
                 continue
             v = item[loc]
@@ -485,7 +506,7 @@ class ResultCache(SearchQueryParser):  # {{{
                 raise ParseException(_('Non-numeric value in query: {0}').format(query))
 
         for id_ in candidates:
-            item = self._data[id_]
+            item = self._data.get(id_)
             if item is None:
                 continue
             try:
@@ -539,7 +560,7 @@ class ResultCache(SearchQueryParser):  # {{{
         split_char = self.field_metadata[location]['is_multiple'].get(
                 'cache_to_list', ',')
         for id_ in candidates:
-            item = self._data[id_]
+            item = self._data.get(id_)
             if item is None:
                 continue
 
@@ -612,7 +633,7 @@ class ResultCache(SearchQueryParser):  # {{{
         if query not in self.local_bool_values:
             raise ParseException(_('Invalid boolean query "{0}"').format(query))
         for id_ in candidates:
-            item = self._data[id_]
+            item = self._data.get(id_)
             if item is None:
                 continue
 
@@ -790,7 +811,7 @@ class ResultCache(SearchQueryParser):  # {{{
                     q = query
 
                 for id_ in current_candidates:
-                    item = self._data[id_]
+                    item = self._data.get(id_)
                     if item is None:
                         continue
 
@@ -873,10 +894,7 @@ class ResultCache(SearchQueryParser):  # {{{
                 self.search_restriction_book_count = len(self._map)
             return list(self._map)
         matches = self.parse(q)
-        tmap = list(repeat(False, len(self._data)))
-        for x in matches:
-            tmap[x] = True
-        rv = [x for x in self._map if tmap[x]]
+        rv = [x for x in self._map if x in matches]
         if set_restriction_count and q == search_restriction:
             self.search_restriction_book_count = len(rv)
         return rv
@@ -931,6 +949,7 @@ class ResultCache(SearchQueryParser):  # {{{
                 itervalues(id_dict))))
 
         # Set the values in the cache
+        self._last_sort = None
         marked_col = self.FIELD_MAP['marked']
         for r in self.iterall():
             r[marked_col] = None
@@ -947,15 +966,17 @@ class ResultCache(SearchQueryParser):  # {{{
 
     # }}}
 
+    def _remove_data(self, id):
+        row = self._data.pop(id, None)
+        if row is not None:
+            self._uuid_map.pop(row[self._uuid_column_index], None)
+
     def remove(self, id):
-        try:
-            self._uuid_map.pop(self._data[id][self._uuid_column_index], None)
-        except (IndexError, TypeError):
-            pass  # id is out of bounds -- no uuid in the map to remove
-        try:
-            self._data[id] = None
-        except IndexError:
-            pass  # id is out of bounds, no point setting it to None anyway
+        if not self.has_id(id):
+            # _map only ever contains ids that have data, so there is no need
+            # for the linear scans below
+            return
+        self._remove_data(id)
         try:
             self._map.remove(id)
         except ValueError:
@@ -968,6 +989,7 @@ class ResultCache(SearchQueryParser):  # {{{
     def set(self, row, col, val, row_is_id=False):
         id = row if row_is_id else self._map_filtered[row]
         d = self._data[id]
+        self._last_sort = None
         if col == self._uuid_column_index:
             self._uuid_map.pop(d[col], None)
         d[col] = val
@@ -987,27 +1009,24 @@ class ResultCache(SearchQueryParser):  # {{{
         return self.index(id)
 
     def has_id(self, id):
-        try:
-            return self._data[id] is not None
-        except IndexError:
-            pass
-        return False
+        return id in self._data
 
     def refresh_ids(self, db, ids):
         '''
         Refresh the data in the cache for books identified by ids.
         Returns a list of affected rows or None if the rows are filtered.
         '''
+        self._last_sort = None
+        rows = fetch_meta_rows(db, ids)
         for id in ids:
             try:
                 self._data[id] = CacheRow(db, self.composites, self.datetimes,
-                        db.conn.get('SELECT * from meta2 WHERE id=?', (id,))[0],
-                        self.series_col, self.series_sort_col)
+                        rows[id], self.series_col, self.series_sort_col)
                 self._data[id].append(db.book_on_device_string(id))
                 self._data[id].append(self.marked_ids_dict.get(id, None))
                 self._data[id].append(None)
                 self._uuid_map[self._data[id][self._uuid_column_index]] = id
-            except IndexError:
+            except (KeyError, IndexError):
                 return None
         try:
             return list(map(self.row, ids))
@@ -1018,11 +1037,11 @@ class ResultCache(SearchQueryParser):  # {{{
     def books_added(self, ids, db):
         if not ids:
             return
-        self._data.extend(repeat(None, max(ids)-len(self._data)+2))
+        self._last_sort = None
+        rows = fetch_meta_rows(db, ids)
         for id in ids:
             self._data[id] = CacheRow(db, self.composites, self.datetimes,
-                        db.conn.get('SELECT * from meta2 WHERE id=?', (id,))[0],
-                        self.series_col, self.series_sort_col)
+                        rows[id], self.series_col, self.series_sort_col)
             self._data[id].append(db.book_on_device_string(id))
             self._data[id].append(self.marked_ids_dict.get(id, None))
             self._data[id].append(None)  # Series sort column
@@ -1031,35 +1050,40 @@ class ResultCache(SearchQueryParser):  # {{{
         self._map_filtered[0:0] = ids
 
     def books_deleted(self, ids):
+        ids = frozenset(ids)
         for id in ids:
-            self.remove(id)
+            self._remove_data(id)
+        # Rebuild the maps in a single pass, calling list.remove() for every
+        # id is quadratic when deleting many books
+        self._map = [x for x in self._map if x not in ids]
+        self._map_filtered = [x for x in self._map_filtered if x not in ids]
 
     def count(self):
         return len(self._map)
 
     def refresh_ondevice(self, db):
         ondevice_col = self.FIELD_MAP['ondevice']
-        for item in self._data:
-            if item is not None:
-                item[ondevice_col] = db.book_on_device_string(item[0])
-                item.refresh_composites()
+        self._last_sort = None
+        for item in itervalues(self._data):
+            item[ondevice_col] = db.book_on_device_string(item[0])
+            item.refresh_composites()
 
     def refresh(self, db, field=None, ascending=True):
         # reinitialize the template cache in case a composite column has changed
         db.initialize_template_cache()
 
+        self._last_sort = None
         temp = db.conn.get('SELECT * FROM meta2')
-        self._data = list(repeat(None, temp[-1][0]+2)) if temp else []
+        self._data = {}
         for r in temp:
             self._data[r[0]] = CacheRow(db, self.composites, self.datetimes, r,
                                         self.series_col, self.series_sort_col)
             self._uuid_map[self._data[r[0]][self._uuid_column_index]] = r[0]
 
-        for item in self._data:
-            if item is not None:
-                item.append(db.book_on_device_string(item[0]))
-                # Temp mark and series_sort columns
-                item.extend((None, None))
+        for item in itervalues(self._data):
+            item.append(db.book_on_device_string(item[0]))
+            # Temp mark and series_sort columns
+            item.extend((None, None))
 
         marked_col = self.FIELD_MAP['marked']
         for id_,val in iteritems(self.marked_ids_dict):
@@ -1068,7 +1092,7 @@ class ResultCache(SearchQueryParser):  # {{{
             except:
                 pass
 
-        self._map = [i[0] for i in self._data if i is not None]
+        self._map = list(self._data)
         if field is not None:
             self.sort(field, ascending)
         self._map_filtered = list(self._map)
@@ -1105,15 +1129,19 @@ class ResultCache(SearchQueryParser):  # {{{
         if not fields:
             fields = [('timestamp', False)]
 
-        keyg = SortKeyGenerator(fields, self.field_metadata, self._data, self.db_prefs)
         if only_ids is None:
+            # Sorting is stable, so re-sorting on the same fields when nothing
+            # has changed since the last sort would leave _map unchanged
+            if fields == self._last_sort:
+                return
+            keyg = SortKeyGenerator(fields, self.field_metadata, self._data, self.db_prefs)
             self._map.sort(key=keyg)
+            self._last_sort = fields
 
-            tmap = list(repeat(False, len(self._data)))
-            for x in self._map_filtered:
-                tmap[x] = True
-            self._map_filtered = [x for x in self._map if tmap[x]]
+            filtered = frozenset(self._map_filtered)
+            self._map_filtered = [x for x in self._map if x in filtered]
         else:
+            keyg = SortKeyGenerator(fields, self.field_metadata, self._data, self.db_prefs)
             only_ids.sort(key=keyg)
 
 
@@ -9,7 +9,7 @@ __docformat__ = 'restructuredtext en'
 import re, os, traceback, fnmatch
 
 from calibre import isbytestring
-from calibre.constants import filesystem_encoding
+from calibre.constants import filesystem_encoding, iswindows
 from calibre.ebooks import BOOK_EXTENSIONS
 from polyglot.builtins import iteritems, filter
 
@@ -84,23 +84,28 @@ class CheckLibrary(object):
                 self.conflicting_custom_cols or self.failed_restores
 
     def ignore_name(self, filename):
-        for filespec in self.ignore_names:
-            if fnmatch.fnmatch(filename, filespec):
-                return True
-        return False
+        return self.ignore_pat is not None and self.ignore_pat.match(filename) is not None
 
     def scan_library(self, name_ignores, extension_ignores):
         self.ignore_names = frozenset(name_ignores)
+        # Compile the ignore patterns once, instead of running fnmatch for
+        # every pattern on every directory entry. fnmatch() normalizes case
+        # on windows, so match case insensitively there.
+        self.ignore_pat = re.compile('|'.join(map(fnmatch.translate, self.ignore_names)),
+                                     re.IGNORECASE if iswindows else 0) if self.ignore_names else None
         self.ignore_ext = frozenset(['.'+ e for e in extension_ignores])
 
         lib = self.src_library_path
-        for auth_dir in os.listdir(lib):
+        # Use scandir() so that the directory checks below can use the file
+        # type returned by the directory listing rather than a stat() per entry
+        for auth_entry in os.scandir(lib):
+            auth_dir = auth_entry.name
             if self.ignore_name(auth_dir) or auth_dir in {'metadata.db',
                     'metadata_db_prefs_backup.json'}:
                 continue
-            auth_path = os.path.join(lib, auth_dir)
+            auth_path = auth_entry.path
             # First check: author must be a directory
-            if not os.path.isdir(auth_path):
+            if not auth_entry.is_dir():
                 self.invalid_authors.append((auth_dir, auth_dir, 0))
                 continue
 
@@ -109,14 +114,14 @@ class CheckLibrary(object):
             # Look for titles in the author directories
             found_titles = False
             try:
-                for title_dir in os.listdir(auth_path):
+                for title_entry in os.scandir(auth_path):
+                    title_dir = title_entry.name
                     if self.ignore_name(title_dir):
                         continue
-                    title_path = os.path.join(auth_path, title_dir)
                     db_path = os.path.join(auth_dir, title_dir)
                     m = self.db_id_regexp.search(title_dir)
                     # Second check: title must have an ID and must be a directory
-                    if m is None or not os.path.isdir(title_path):
+                    if m is None or not title_entry.is_dir():
                         self.invalid_titles.append((auth_dir, db_path, 0))
                         continue
 
@@ -151,7 +156,7 @@ class CheckLibrary(object):
             except:
                 traceback.print_exc()
                 # Sort-of check: exception processing directory
-                self.failed_folders.append((title_path, traceback.format_exc(), []))
+                self.failed_folders.append((x[0], traceback.format_exc(), []))
 
         # Check for formats and covers in db for book dirs that are gone
         for id_ in self.all_ids:
@@ -557,8 +557,8 @@ class CustomColumns(object):
             if not append or not data['is_multiple']:
                 self.conn.execute('DELETE FROM %s WHERE book=?'%lt, (id_,))
                 self.conn.execute(
-                '''DELETE FROM %s WHERE (SELECT COUNT(id) FROM %s WHERE
-                    value=%s.id) < 1''' % (table, lt, table))
+                '''DELETE FROM %s WHERE NOT EXISTS (SELECT 1 FROM %s WHERE
+                    value=%s.id)''' % (table, lt, table))
                 self.data._data[id_][self.FIELD_MAP[data['num']]] = None
             set_val = val if data['is_multiple'] else [val]
             existing = getter()
@@ -625,15 +625,18 @@ class CustomColumns(object):
         return books_to_refresh
 
     def clean_custom(self):
-        st = ('DELETE FROM {table} WHERE (SELECT COUNT(id) FROM {lt} WHERE'
-           ' {lt}.value={table}.id) < 1;')
+        st = ('DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM {lt} WHERE'
+           ' {lt}.value={table}.id);')
         statements = []
         for data in self.custom_column_num_map.values():
             if data['normalized']:
                 table, lt = self.custom_table_names(data['num'])
                 statements.append(st.format(lt=lt, table=table))
         if statements:
-            self.conn.executescript(' \n'.join(statements))
+            # Do not use executescript() as it commits any pending transaction
+            # and then runs each statement in a transaction of its own
+            for statement in statements:
+                self.conn.execute(statement)
             self.conn.commit()
 
     def custom_columns_in_meta(self):
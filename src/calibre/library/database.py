@@ -9,7 +9,7 @@ Backend that implements storage of ebooks in an sqlite database.
 
 import sqlite3 as sqlite
 import datetime, re, sre_constants
-from zlib import compress, decompress
+from zlib import compress, compressobj, decompress
 
 from calibre.ebooks.metadata import MetaInformation
 from calibre.ebooks.metadata import string_to_authors
@@ -23,19 +23,17 @@ class Concatenate(object):
 
     def __init__(self, sep=','):
         self.sep = sep
-        self.ans = ''
+        self.ans = []
 
     def step(self, value):
         if value is not None:
-            self.ans += value + self.sep
+            self.ans.append(value)
 
     def finalize(self):
         try:
             if not self.ans:
                 return None
-            if self.sep:
-                return self.ans[:-len(self.sep)]
-            return self.ans
+            return self.sep.join(self.ans)
         except Exception:
             import traceback
             traceback.print_exc()
@@ -54,19 +52,38 @@ class Connection(sqlite.Connection):
         return ans.fetchall()
 
 
+def compress_stream(stream, chunk_size=1024 * 1024):
+    '''
+    Same as compress(stream.read()), but reads the stream a chunk at a time, so
+    that only the compressed data is ever held in memory in full.
+    '''
+    c, ans = compressobj(), []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        ans.append(c.compress(chunk))
+    ans.append(c.flush())
+    return b''.join(ans)
+
+
 def _connect(path):
     if isinstance(path, unicode_type):
         path = path.encode('utf-8')
     conn =  sqlite.connect(path, factory=Connection, detect_types=sqlite.PARSE_DECLTYPES|sqlite.PARSE_COLNAMES)
     conn.row_factory = lambda cursor, row : list(row)
     conn.create_aggregate('concat', 1, Concatenate)
-    title_pat = re.compile(r'^(A|The|An)\s+', re.IGNORECASE)
 
     def title_sort(title):
-        match = title_pat.search(title)
-        if match:
-            prep = match.group(1)
-            title = title.replace(prep, '') + ', ' + prep
+        # Called by SQLite for every row written to books, so avoid the
+        # regex engine and use a plain prefix test
+        lo = title[:4].lower()
+        for prep in ('the', 'an', 'a'):
+            n = len(prep)
+            if lo.startswith(prep) and title[n:n+1].isspace():
+                prep = title[:n]
+                title = title.replace(prep, '') + ', ' + prep
+                break
         return title.strip()
     conn.create_function('title_sort', 1, title_sort)
     return conn
@@ -79,25 +96,39 @@ class LibraryDatabase(object):
         '''
         Iterator over the books in the old pre 0.4.0 database.
         '''
+        # The old database is only ever read from, use a dedicated read-only
+        # connection for it and close it when done
         conn = sqlite.connect(path)
-        cur = conn.execute('select * from books_meta order by id;')
-        book = cur.fetchone()
-        while book:
-            id = book[0]
-            meta = {'title':book[1], 'authors':book[2], 'publisher':book[3],
-                     'tags':book[5], 'comments':book[7], 'rating':book[8],
-                     'timestamp':datetime.datetime.strptime(book[6], '%Y-%m-%d %H:%M:%S'),
-                    }
-            cover = {}
-            query = conn.execute('select uncompressed_size, data from books_cover where id=?', (id,)).fetchone()
-            if query:
-                cover = {'uncompressed_size': query[0], 'data': query[1]}
-            query = conn.execute('select extension, uncompressed_size, data from books_data where id=?', (id,)).fetchall()
-            formats = {}
-            for row in query:
-                formats[row[0]] = {'uncompressed_size':row[1], 'data':row[2]}
-            yield meta, cover, formats
+        try:
+            conn.execute('pragma query_only=1')
+            cur = conn.execute('select * from books_meta order by id;')
+            # Read covers and formats alongside the books, in id order, rather
+            # than querying for them once per book. They are not read into
+            # memory up front as they contain the actual book files.
+            covers = conn.execute('select id, uncompressed_size, data from books_cover where id is not null order by id;')
+            fmts = conn.execute('select id, extension, uncompressed_size, data from books_data where id is not null order by id;')
+            crow, frow = covers.fetchone(), fmts.fetchone()
             book = cur.fetchone()
+            while book:
+                id = book[0]
+                meta = {'title':book[1], 'authors':book[2], 'publisher':book[3],
+                         'tags':book[5], 'comments':book[7], 'rating':book[8],
+                         'timestamp':datetime.datetime.strptime(book[6], '%Y-%m-%d %H:%M:%S'),
+                        }
+                cover = {}
+                while crow is not None and crow[0] < id:
+                    crow = covers.fetchone()
+                if crow is not None and crow[0] == id:
+                    cover = {'uncompressed_size': crow[1], 'data': crow[2]}
+                formats = {}
+                while frow is not None and frow[0] <= id:
+                    if frow[0] == id:
+                        formats[frow[1]] = {'uncompressed_size':frow[2], 'data':frow[3]}
+                    frow = fmts.fetchone()
+                yield meta, cover, formats
+                book = cur.fetchone()
+        finally:
+            conn.close()
 
     @staticmethod
     def sizeof_old_database(path):
@@ -109,61 +140,67 @@ class LibraryDatabase(object):
     @staticmethod
     def import_old_database(path, conn, progress=None):
         count = 0
+        # Looked up once, this is called several times for every book
+        execute = conn.execute
         for book, cover, formats in LibraryDatabase.books_in_old_database(path):
             authors = book['authors']
             if not authors:
                 authors = 'Unknown'
-            obj = conn.execute('INSERT INTO books(title, timestamp, author_sort) VALUES (?,?,?)',
-                               (book['title'], book['timestamp'], authors))
+            obj = execute('INSERT INTO books(title, timestamp, author_sort) VALUES (?,?,?)',
+                          (book['title'], book['timestamp'], authors))
             id = obj.lastrowid
             authors = string_to_authors(authors)
+            links = []
             for a in authors:
-                author = conn.execute('SELECT id from authors WHERE name=?', (a,)).fetchone()
+                author = execute('SELECT id from authors WHERE name=?', (a,)).fetchone()
                 if author:
                     aid = author[0]
                 else:
-                    aid = conn.execute('INSERT INTO authors(name) VALUES (?)', (a,)).lastrowid
-                conn.execute('INSERT INTO books_authors_link(book, author) VALUES (?,?)', (id, aid))
+                    aid = execute('INSERT INTO authors(name) VALUES (?)', (a,)).lastrowid
+                links.append((id, aid))
+            conn.executemany('INSERT INTO books_authors_link(book, author) VALUES (?,?)', links)
             if book['publisher']:
-                candidate = conn.execute('SELECT id from publishers WHERE name=?', (book['publisher'],)).fetchone()
-                pid = candidate[0] if candidate else conn.execute('INSERT INTO publishers(name) VALUES (?)',
-                                                              (book['publisher'],)).lastrowid
-                conn.execute('INSERT INTO books_publishers_link(book, publisher) VALUES (?,?)', (id, pid))
+                candidate = execute('SELECT id from publishers WHERE name=?', (book['publisher'],)).fetchone()
+                pid = candidate[0] if candidate else execute('INSERT INTO publishers(name) VALUES (?)',
+                                                             (book['publisher'],)).lastrowid
+                execute('INSERT INTO books_publishers_link(book, publisher) VALUES (?,?)', (id, pid))
             if book['rating']:
-                candidate = conn.execute('SELECT id from ratings WHERE rating=?', (2*book['rating'],)).fetchone()
-                rid = candidate[0] if candidate else conn.execute('INSERT INTO ratings(rating) VALUES (?)',
-                                                              (2*book['rating'],)).lastrowid
-                conn.execute('INSERT INTO books_ratings_link(book, rating) VALUES (?,?)', (id, rid))
+                candidate = execute('SELECT id from ratings WHERE rating=?', (2*book['rating'],)).fetchone()
+                rid = candidate[0] if candidate else execute('INSERT INTO ratings(rating) VALUES (?)',
+                                                             (2*book['rating'],)).lastrowid
+                execute('INSERT INTO books_ratings_link(book, rating) VALUES (?,?)', (id, rid))
             tags = book['tags']
             if tags:
                 tags = tags.split(',')
             else:
                 tags = []
+            links = []
             for a in tags:
                 a = a.strip()
                 if not a:
                     continue
-                tag = conn.execute('SELECT id from tags WHERE name=?', (a,)).fetchone()
+                tag = execute('SELECT id from tags WHERE name=?', (a,)).fetchone()
                 if tag:
                     tid = tag[0]
                 else:
-                    tid = conn.execute('INSERT INTO tags(name) VALUES (?)', (a,)).lastrowid
-                conn.execute('INSERT INTO books_tags_link(book, tag) VALUES (?,?)', (id, tid))
+                    tid = execute('INSERT INTO tags(name) VALUES (?)', (a,)).lastrowid
+                links.append((id, tid))
+            conn.executemany('INSERT INTO books_tags_link(book, tag) VALUES (?,?)', links)
             comments = book['comments']
             if comments:
-                conn.execute('INSERT INTO comments(book, text) VALUES (?, ?)',
-                             (id, comments))
+                execute('INSERT INTO comments(book, text) VALUES (?, ?)',
+                        (id, comments))
             if cover:
-                conn.execute('INSERT INTO covers(book, uncompressed_size, data) VALUES (?, ?, ?)',
-                             (id, cover['uncompressed_size'], cover['data']))
-            for format in formats.keys():
-                conn.execute('INSERT INTO data(book, format, uncompressed_size, data) VALUES (?, ?, ?, ?)',
-                             (id, format, formats[format]['uncompressed_size'],
-                              formats[format]['data']))
-            conn.commit()
+                execute('INSERT INTO covers(book, uncompressed_size, data) VALUES (?, ?, ?)',
+                        (id, cover['uncompressed_size'], cover['data']))
+            conn.executemany('INSERT INTO data(book, format, uncompressed_size, data) VALUES (?, ?, ?, ?)',
+                             [(id, format, f['uncompressed_size'], f['data'])
+                              for format, f in formats.items()])
             count += 1
             if progress:
                 progress(count)
+        # Commit the whole import at once, rather than once per book
+        conn.commit()
 
     @staticmethod
     def create_version1(conn):
@@ -887,28 +924,16 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
         @param OR: If True, keeps a match if any one of the filters matches. If False,
         keeps a match only if all the filters match
         '''
-        if not filters:
-            self.data = self.data if refilter else self.cache
+        source = self.data if refilter else self.cache
+        if not filters or not source:
+            self.data = source
         else:
-            matches = []
-            for item in self.data if refilter else self.cache:
-                if OR:
-                    keep = False
-                    for token in filters:
-                        if token.match(item):
-                            keep = True
-                            break
-                    if keep:
-                        matches.append(item)
-                else:
-                    keep = True
-                    for token in filters:
-                        if not token.match(item):
-                            keep = False
-                            break
-                    if keep:
-                        matches.append(item)
-            self.data = matches
+            # Evaluate each token against a whole column at a time, rather than
+            # dispatching on every row tuple for every token
+            cols = list(zip(*source))
+            combine = any if OR else all
+            keep = map(combine, zip(*[token.match_column(cols) for token in filters]))
+            self.data = [item for item, k in zip(source, keep) if k]
 
     def rows(self):
         return len(self.data) if self.data else 0
@@ -1018,13 +1043,12 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
         Return an ordered list of all books in the series.
         The list contains book ids.
         '''
-        ans = self.conn.get('SELECT book from books_series_link WHERE series=?',
-                                (series_id,))
-        if not ans:
-            return []
-        ans = [id[0] for id in ans]
-        ans.sort(key=lambda x: self.series_index(x, True))
-        return ans
+        ans = self.conn.get('''
+            SELECT books_series_link.book FROM books_series_link
+            JOIN books ON books.id=books_series_link.book
+            WHERE books_series_link.series=?
+            ORDER BY books.series_index, books_series_link.id''', (series_id,))
+        return [id[0] for id in ans]
 
     def books_in_series_of(self, index, index_is_id=False):
         '''
@@ -1125,7 +1149,7 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
         stream.seek(0, 2)
         usize = stream.tell()
         stream.seek(0)
-        data = sqlite.Binary(compress(stream.read()))
+        data = sqlite.Binary(compress_stream(stream))
         exts = self.formats(index, index_is_id=index_is_id)
         if not exts:
             exts = []
@@ -1133,10 +1157,8 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
             ext = ''
         ext = ext.lower()
         if ext in exts:
-            self.conn.execute('UPDATE data SET data=? WHERE format=? AND book=?',
-                              (data, ext, id))
-            self.conn.execute('UPDATE data SET uncompressed_size=? WHERE format=? AND book=?',
-                              (usize, ext, id))
+            self.conn.execute('UPDATE data SET data=?, uncompressed_size=? WHERE format=? AND book=?',
+                              (data, usize, ext, id))
         else:
             self.conn.execute('INSERT INTO data(book, format, uncompressed_size, data) VALUES (?, ?, ?, ?)',
                               (id, ext, usize, data))
@@ -1184,23 +1206,23 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
         '''
         @param authors: A list of authors.
         '''
-        self.conn.execute('DELETE FROM books_authors_link WHERE book=?',(id,))
-        for a in authors:
-            if not a:
-                continue
-            a = a.strip()
-            author = self.conn.get('SELECT id from authors WHERE name=?', (a,), all=False)
-            if author:
-                aid = author
-                # Handle change of case
-                self.conn.execute('UPDATE authors SET name=? WHERE id=?', (a, aid))
-            else:
-                aid = self.conn.execute('INSERT INTO authors(name) VALUES (?)', (a,)).lastrowid
-            try:
-                self.conn.execute('INSERT INTO books_authors_link(book, author) VALUES (?,?)', (id, aid))
-            except sqlite.IntegrityError:  # Sometimes books specify the same author twice in their metadata
-                pass
-        self.conn.commit()
+        with self.conn:
+            self.conn.execute('DELETE FROM books_authors_link WHERE book=?',(id,))
+            for a in authors:
+                if not a:
+                    continue
+                a = a.strip()
+                author = self.conn.get('SELECT id from authors WHERE name=?', (a,), all=False)
+                if author:
+                    aid = author
+                    # Handle change of case
+                    self.conn.execute('UPDATE authors SET name=? WHERE id=?', (a, aid))
+                else:
+                    aid = self.conn.execute('INSERT INTO authors(name) VALUES (?)', (a,)).lastrowid
+                try:
+                    self.conn.execute('INSERT INTO books_authors_link(book, author) VALUES (?,?)', (id, aid))
+                except sqlite.IntegrityError:  # Sometimes books specify the same author twice in their metadata
+                    pass
 
     def set_author_sort(self, id, sort):
         self.conn.execute('UPDATE books SET author_sort=? WHERE id=?', (sort, id))
@@ -1217,15 +1239,15 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
         self.conn.commit()
 
     def set_publisher(self, id, publisher):
-        self.conn.execute('DELETE FROM books_publishers_link WHERE book=?',(id,))
-        if publisher:
-            pub = self.conn.get('SELECT id from publishers WHERE name=?', (publisher,), all=False)
-            if pub:
-                aid = pub
-            else:
-                aid = self.conn.execute('INSERT INTO publishers(name) VALUES (?)', (publisher,)).lastrowid
-            self.conn.execute('INSERT INTO books_publishers_link(book, publisher) VALUES (?,?)', (id, aid))
-        self.conn.commit()
+        with self.conn:
+            self.conn.execute('DELETE FROM books_publishers_link WHERE book=?',(id,))
+            if publisher:
+                pub = self.conn.get('SELECT id from publishers WHERE name=?', (publisher,), all=False)
+                if pub:
+                    aid = pub
+                else:
+                    aid = self.conn.execute('INSERT INTO publishers(name) VALUES (?)', (publisher,)).lastrowid
+                self.conn.execute('INSERT INTO books_publishers_link(book, publisher) VALUES (?,?)', (id, aid))
 
     def set_comment(self, id, text):
         self.conn.execute('DELETE FROM comments WHERE book=?', (id,))
@@ -1248,48 +1270,46 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
         @param tags: list of strings
         @param append: If True existing tags are not removed
         '''
-        if not append:
-            self.conn.execute('DELETE FROM books_tags_link WHERE book=?', (id,))
-        for tag in set(tags):
-            tag = tag.lower().strip()
-            if not tag:
-                continue
-            t = self.conn.get('SELECT id FROM tags WHERE name=?', (tag,), all=False)
-            if t:
-                tid = t
-            else:
-                tid = self.conn.execute('INSERT INTO tags(name) VALUES(?)', (tag,)).lastrowid
+        with self.conn:
+            if not append:
+                self.conn.execute('DELETE FROM books_tags_link WHERE book=?', (id,))
+            for tag in set(tags):
+                tag = tag.lower().strip()
+                if not tag:
+                    continue
+                t = self.conn.get('SELECT id FROM tags WHERE name=?', (tag,), all=False)
+                if t:
+                    tid = t
+                else:
+                    tid = self.conn.execute('INSERT INTO tags(name) VALUES(?)', (tag,)).lastrowid
 
-            if not self.conn.get('SELECT book FROM books_tags_link WHERE book=? AND tag=?',
-                                        (id, tid), all=False):
-                self.conn.execute('INSERT INTO books_tags_link(book, tag) VALUES (?,?)',
-                              (id, tid))
-        self.conn.commit()
+                # The UNIQUE(book, tag) constraint takes care of existing links
+                self.conn.execute('INSERT OR IGNORE INTO books_tags_link(book, tag) VALUES (?,?)',
+                                  (id, tid))
 
     def set_series(self, id, series):
-        self.conn.execute('DELETE FROM books_series_link WHERE book=?',(id,))
-        if series:
-            s = self.conn.get('SELECT id from series WHERE name=?', (series,), all=False)
-            if s:
-                aid = s
-            else:
-                aid = self.conn.execute('INSERT INTO series(name) VALUES (?)', (series,)).lastrowid
-            self.conn.execute('INSERT INTO books_series_link(book, series) VALUES (?,?)', (id, aid))
-        self.conn.commit()
+        with self.conn:
+            self.conn.execute('DELETE FROM books_series_link WHERE book=?',(id,))
+            if series:
+                s = self.conn.get('SELECT id from series WHERE name=?', (series,), all=False)
+                if s:
+                    aid = s
+                else:
+                    aid = self.conn.execute('INSERT INTO series(name) VALUES (?)', (series,)).lastrowid
+                self.conn.execute('INSERT INTO books_series_link(book, series) VALUES (?,?)', (id, aid))
         row = self.row(id)
         if row is not None:
             self.data[row][9] = series
 
     def remove_unused_series(self):
-        for id, in self.conn.get('SELECT id FROM series'):
-            if not self.conn.get('SELECT id from books_series_link WHERE series=?', (id,)):
-                self.conn.execute('DELETE FROM series WHERE id=?', (id,))
+        self.conn.execute('''DELETE FROM series WHERE NOT EXISTS
+                             (SELECT 1 FROM books_series_link WHERE series=series.id)''')
         self.conn.commit()
 
     def set_series_index(self, id, idx):
         idx = int(idx)
-        self.conn.execute('UPDATE books SET series_index=? WHERE id=?', (int(idx), id))
-        self.conn.commit()
+        with self.conn:
+            self.conn.execute('UPDATE books SET series_index=? WHERE id=?', (int(idx), id))
         row = self.row(id)
         if row is not None:
             self.data[row][10] = idx
@@ -1319,9 +1339,7 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
             self.set_title(id, mi.title)
         if not mi.authors:
             mi.authors = ['Unknown']
-        authors = []
-        for a in mi.authors:
-            authors += string_to_authors(a)
+        authors = [x for a in mi.authors for x in string_to_authors(a)]
         self.set_authors(id, authors)
         if mi.author_sort:
             self.set_author_sort(id, mi.author_sort)
@@ -1364,7 +1382,7 @@ ALTER TABLE books ADD COLUMN isbn TEXT DEFAULT "" COLLATE NOCASE;
             stream.seek(0)
 
             self.conn.execute('INSERT INTO data(book, format, uncompressed_size, data) VALUES (?,?,?,?)',
-                              (id, format, usize, sqlite.Binary(compress(stream.read()))))
+                              (id, format, usize, sqlite.Binary(compress_stream(stream))))
             if not hasattr(path, 'read'):
                 stream.close()
         self.conn.commit()
@@ -1499,6 +1517,19 @@ class SearchToken(object):
             text = ' '.join([item[i] if item[i] else '' for i in self.FIELD_MAP.values()])
         return bool(self.pattern.search(text)) ^ self.negate
 
+    def match_column(self, cols):
+        '''
+        Return a list of booleans, one per row, indicating if the row matches.
+        @param cols: The rows to be matched, transposed into a list of columns
+        '''
+        search, negate = self.pattern.search, self.negate
+        if self.index >= 0:
+            texts = cols[self.index]
+        else:
+            texts = map(lambda *x: ' '.join([t if t else '' for t in x]),
+                        *[cols[i] for i in self.FIELD_MAP.values()])
+        return [bool(search(text if text else '')) ^ negate for text in texts]
+
 
 def text_to_tokens(text):
     OR = False
@@ -10,7 +10,9 @@ The database used to store ebook metadata
 
 import os, sys, shutil, glob, time, functools, traceback, re, \
         json, uuid, hashlib, copy, numbers
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 import threading, random
 
 from calibre import prints, force_unicode
@@ -49,7 +51,7 @@ from calibre.db.lazy import FormatMetadata, FormatsList
 from calibre.db.categories import Tag, CATEGORY_SORTS
 from calibre.utils.localization import (canonicalize_lang,
         calibre_langcode_to_name)
-from polyglot.builtins import iteritems, unicode_type, string_or_bytes, map
+from polyglot.builtins import iteritems, itervalues, unicode_type, string_or_bytes, map
 
 copyfile = os.link if hasattr(os, 'link') else shutil.copyfile
 SPOOL_SIZE = 30*1024*1024
@@ -57,6 +59,14 @@ SPOOL_SIZE = 30*1024*1024
 ProxyMetadata = namedtuple('ProxyMetadata', 'book_size ondevice_col db_approx_formats')
 
 
+def copy_tag(tag, new_tag=Tag.__new__, slots=Tag.__slots__):
+    ' A shallow copy of tag, much faster than copy.copy() '
+    ans = new_tag(Tag)
+    for attr in slots:
+        setattr(ans, attr, getattr(tag, attr))
+    return ans
+
+
 class DBPrefsWrapper(object):
 
     def __init__(self, db):
@@ -134,8 +144,6 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         # so that various code that connects directly will not complain about
         # missing functions
         self.books_list_filter = self.conn.create_dynamic_filter('books_list_filter')
-        # Store temporary tables in memory
-        self.conn.execute('pragma temp_store=2')
         self.conn.commit()
 
     @classmethod
@@ -155,6 +163,8 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
             traceback.print_exc()
         self.field_metadata = FieldMetadata()
         self.format_filename_cache = defaultdict(dict)
+        self.name_parts_cache = {}
+        self.categories_cache = OrderedDict()
         self._library_id_ = None
         # Create the lock to be used to guard access to the metadata writer
         # queues. This must be an RLock, not a Lock
@@ -214,7 +224,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         self.formatter_template_cache = {}
 
     def get_property(self, idx, index_is_id=False, loc=-1):
-        row = self.data._data[idx] if index_is_id else self.data[idx]
+        row = self.data._data.get(idx) if index_is_id else self.data[idx]
         if row is not None:
             return row[loc]
 
@@ -503,7 +513,6 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         self.data    = ResultCache(self.FIELD_MAP, self.field_metadata, db_prefs=self.prefs)
         self.search  = self.data.search
         self.search_getting_ids  = self.data.search_getting_ids
-        self.refresh = functools.partial(self.data.refresh, self)
         self.sort    = self.data.sort
         self.multisort = self.data.multisort
         self.index   = self.data.index
@@ -573,6 +582,10 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         ''' Return last modified time as a UTC datetime object'''
         return utcfromtimestamp(os.stat(self.dbpath).st_mtime)
 
+    def refresh(self, field=None, ascending=True):
+        self.categories_cache.clear()
+        self.data.refresh(self, field=field, ascending=ascending)
+
     def refresh_format_cache(self):
         self.format_filename_cache = defaultdict(dict)
         for book_id, fmt, name in self.conn.get(
@@ -598,17 +611,31 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
             os.makedirs(path)
         return path
 
+    def _name_parts(self, id):
+        '''
+        Return the filesystem safe author and title used to construct path
+        and file names for this book. Converting them is not cheap and the
+        same book is looked up repeatedly when moving its files, so the result
+        is remembered for as long as the authors and title stay the same.
+        '''
+        authors = self.authors(id, index_is_id=True)
+        title = self.title(id, index_is_id=True)
+        key = authors, title
+        ans = self.name_parts_cache.get(id)
+        if ans is None or ans[0] != key:
+            if not authors:
+                authors = _('Unknown')
+            author = ascii_filename(authors.split(',')[0].replace('|', ',')
+                        )[:self.PATH_LIMIT]
+            title  = ascii_filename(title)[:self.PATH_LIMIT]
+            ans = self.name_parts_cache[id] = key, author, title
+        return ans[1:]
+
     def construct_path_name(self, id):
         '''
         Construct the directory name for this book based on its metadata.
         '''
-        authors = self.authors(id, index_is_id=True)
-        if not authors:
-            authors = _('Unknown')
-        author = ascii_filename(authors.split(',')[0].replace('|', ',')
-                    )[:self.PATH_LIMIT]
-        title  = ascii_filename(self.title(id, index_is_id=True)
-                    )[:self.PATH_LIMIT]
+        author, title = self._name_parts(id)
         while author[-1] in (' ', '.'):
             author = author[:-1]
         if not author:
@@ -620,13 +647,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         '''
         Construct the file name for this book based on its metadata.
         '''
-        authors = self.authors(id, index_is_id=True)
-        if not authors:
-            authors = _('Unknown')
-        author = ascii_filename(authors.split(',')[0].replace('|', ',')
-                    )[:self.PATH_LIMIT]
-        title  = ascii_filename(self.title(id, index_is_id=True)
-                    )[:self.PATH_LIMIT]
+        author, title = self._name_parts(id)
         name   = title + ' - ' + author
         while name.endswith('.'):
             name = name[:-1]
@@ -651,7 +672,9 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         id = index if index_is_id else self.id(index)
         path = self.construct_path_name(id)
         current_path = self.path(id, index_is_id=True).replace(os.sep, '/')
-        formats = self.formats(id, index_is_id=True)
+        # No need to check that the format files exist here, copying them
+        # below looks each one up again and skips missing files
+        formats = self.formats(id, index_is_id=True, verify_formats=False)
         formats = formats.split(',') if formats else []
         # Check if the metadata used to construct paths has changed
         fname = self.construct_file_name(id)
@@ -897,6 +920,9 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
 
     def dirtied(self, book_ids, commit=True):
         self.update_last_modified(book_ids)
+        # The file modification time only changes on commit, so forget the
+        # cached categories explicitly
+        self.categories_cache.clear()
         for book in book_ids:
             with self.dirtied_lock:
                 # print 'dirtied: check id', book
@@ -1092,7 +1118,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         return False
 
     def has_id(self, id_):
-        return self.data._data[id_] is not None
+        return self.data.has_id(id_)
 
     def books_with_same_title(self, mi, all_matches=True):
         title = mi.title
@@ -1426,8 +1452,10 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                             return
                         except:
                             pass
-                    with lopen(path, 'rb') as f, lopen(dest, 'wb') as d:
-                        shutil.copyfileobj(f, d)
+                    # Let shutil copy path to path, so that the kernel fast
+                    # copy is used when available rather than moving the whole
+                    # file through Python buffers
+                    shutil.copyfile(path, dest)
 
     def copy_cover_to(self, index, dest, index_is_id=False,
             windows_atomic_move=None, use_hardlink=False):
@@ -1540,7 +1568,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         return retval
 
     def add_format(self, index, format, stream, index_is_id=False, path=None,
-            notify=True, replace=True, copy_function=None):
+            notify=True, replace=True, copy_function=None, commit=True):
         id = index if index_is_id else self.id(index)
         if not format:
             format = ''
@@ -1571,7 +1599,9 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         self.conn.execute('INSERT OR REPLACE INTO data (book,format,uncompressed_size,name) VALUES (?,?,?,?)',
                           (id, format.upper(), size, name))
         self.update_last_modified([id], commit=False)
-        self.conn.commit()
+        self.categories_cache.clear()
+        if commit:
+            self.conn.commit()
         self.format_filename_cache[id][format.upper()] = name
         self.refresh_ids([id])
         if notify:
@@ -1621,11 +1651,13 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
             if len(os.listdir(parent)) == 0:
                 self.rmtree(parent, permanent=permanent)
         self.conn.execute('DELETE FROM books WHERE id=?', (id,))
+        self.categories_cache.clear()
         if commit:
             self.conn.commit()
             if do_clean:
                 self.clean()
         self.data.books_deleted([id])
+        self.name_parts_cache.pop(id, None)
         if notify:
             self.notify('delete', [id])
 
@@ -1646,6 +1678,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                     traceback.print_exc()
             self.format_filename_cache[id].pop(format.upper(), None)
             self.conn.execute('DELETE FROM data WHERE book=? AND format=?', (id, format.upper()))
+            self.categories_cache.clear()
             if commit:
                 self.conn.commit()
             self.refresh_ids([id])
@@ -1656,12 +1689,12 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         # Don't bother with validity checking. Let the exception fly out so
         # we can see what happened
         def doit(table, ltable_col):
-            st = ('DELETE FROM books_%s_link WHERE (SELECT COUNT(id) '
-                    'FROM books WHERE id=book) < 1;')%table
+            st = ('DELETE FROM books_%s_link WHERE NOT EXISTS (SELECT 1 '
+                    'FROM books WHERE id=book);')%table
             self.conn.execute(st)
-            st = ('DELETE FROM %(table)s WHERE (SELECT COUNT(id) '
+            st = ('DELETE FROM %(table)s WHERE NOT EXISTS (SELECT 1 '
                     'FROM books_%(table)s_link WHERE '
-                    '%(ltable_col)s=%(table)s.id) < 1;') % dict(
+                    '%(ltable_col)s=%(table)s.id);') % dict(
                             table=table, ltable_col=ltable_col)
             self.conn.execute(st)
 
@@ -1675,12 +1708,12 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         Remove orphaned entries.
         '''
         def doit(ltable, table, ltable_col):
-            st = ('DELETE FROM books_%s_link WHERE (SELECT COUNT(id) '
-                    'FROM books WHERE id=book) < 1;')%ltable
+            st = ('DELETE FROM books_%s_link WHERE NOT EXISTS (SELECT 1 '
+                    'FROM books WHERE id=book);')%ltable
             self.conn.execute(st)
-            st = ('DELETE FROM %(table)s WHERE (SELECT COUNT(id) '
+            st = ('DELETE FROM %(table)s WHERE NOT EXISTS (SELECT 1 '
                     'FROM books_%(ltable)s_link WHERE '
-                    '%(ltable_col)s=%(table)s.id) < 1;') % dict(
+                    '%(ltable_col)s=%(table)s.id);') % dict(
                             ltable=ltable, table=table, ltable_col=ltable_col)
             self.conn.execute(st)
 
@@ -1700,6 +1733,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 self.conn.execute('DELETE FROM tags WHERE id=?', (id_,))
         self.clean_custom()
         self.conn.commit()
+        self.categories_cache.clear()
 
     def get_books_for_category(self, category, id_):
         ans = set()
@@ -1733,6 +1767,8 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
 
     class TCat_Tag(object):
 
+        __slots__ = ('n', 's', 'c', 'id_set', 'rt', 'rc', 'id')
+
         def __init__(self, name, sort):
             self.n = name
             self.s = sort
@@ -1775,11 +1811,36 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
             pass
         return new_cats
 
+    CATEGORIES_CACHE_SIZE = 25
+
     def get_categories(self, sort='name', ids=None):
-        # start = last = time.clock()
+        '''
+        Results are cached, keyed on the arguments, until the database is next
+        modified. The id_set of the returned tags, if any, is a frozenset.
+        '''
         if sort not in self.CATEGORY_SORTS:
             raise ValueError('sort ' + sort + ' not a valid value')
-
+        key = sort, (None if ids is None else frozenset(ids))
+        # Read the modification time before computing the categories, so that
+        # a write that lands while they are being computed invalidates them
+        stamp = self.last_modified()
+        old = self.categories_cache.pop(key, None)
+        if old is None or old[0] != stamp:
+            categories = self._get_categories(sort=sort, ids=ids)
+            # The id sets are shared by the copies handed out below
+            for tags in itervalues(categories):
+                for tag in tags:
+                    if tag.id_set is not None:
+                        tag.id_set = frozenset(tag.id_set)
+            old = (stamp, categories)
+            if len(self.categories_cache) >= self.CATEGORIES_CACHE_SIZE:
+                self.categories_cache.popitem(last=False)
+        self.categories_cache[key] = old
+        # Callers are free to modify the returned Tag objects
+        return {category:list(map(copy_tag, tags)) for category, tags in iteritems(old[1])}
+
+    def _get_categories(self, sort='name', ids=None):
+        # start = last = time.clock()
         self.books_list_filter.change([] if not ids else ids)
         id_filter = None if ids is None else frozenset(ids)
 
@@ -1997,7 +2058,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 kf = lambda x:sort_key(x.s)
                 reverse=False
             elif sort == 'popularity':
-                kf = lambda x: x.c
+                kf = attrgetter('c')
                 reverse=True
             else:
                 kf = avgr
@@ -2040,57 +2101,52 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         icon = None
         if icon_map and 'formats' in icon_map:
             icon = icon_map['formats']
-        for fmt in self.conn.get('SELECT DISTINCT format FROM data'):
-            fmt = fmt[0]
-            if ids is not None:
-                count = self.conn.get('''SELECT COUNT(id)
-                                       FROM data
-                                       WHERE format=? AND
-                                       books_list_filter(book)''', (fmt,),
-                                       all=False)
-            else:
-                count = self.conn.get('''SELECT COUNT(id)
-                                       FROM data
-                                       WHERE format=?''', (fmt,),
-                                       all=False)
+        # Count all formats in one query, rather than one query per format
+        if ids is not None:
+            counts = self.conn.get('''SELECT format, COUNT(id)
+                                      FROM data
+                                      WHERE books_list_filter(book)
+                                      GROUP BY format''')
+        else:
+            counts = self.conn.get('''SELECT format, COUNT(id)
+                                      FROM data
+                                      GROUP BY format''')
+        for fmt, count in counts:
             if count > 0:
                 categories['formats'].append(Tag(fmt, count=count,
                                                  category='formats', is_editable=False))
 
         if sort == 'popularity':
-            categories['formats'].sort(key=lambda x: x.count, reverse=True)
+            categories['formats'].sort(key=attrgetter('count'), reverse=True)
         else:  # no ratings exist to sort on
             # No need for ICU here.
-            categories['formats'].sort(key=lambda x:x.name)
+            categories['formats'].sort(key=attrgetter('name'))
 
         # Now do identifiers. This works like formats
         categories['identifiers'] = []
         icon = None
         if icon_map and 'identifiers' in icon_map:
             icon = icon_map['identifiers']
-        for ident in self.conn.get('SELECT DISTINCT type FROM identifiers'):
-            ident = ident[0]
-            if ids is not None:
-                count = self.conn.get('''SELECT COUNT(book)
-                                       FROM identifiers
-                                       WHERE type=? AND
-                                       books_list_filter(book)''', (ident,),
-                                       all=False)
-            else:
-                count = self.conn.get('''SELECT COUNT(id)
-                                       FROM identifiers
-                                       WHERE type=?''', (ident,),
-                                       all=False)
+        if ids is not None:
+            counts = self.conn.get('''SELECT type, COUNT(book)
+                                      FROM identifiers
+                                      WHERE books_list_filter(book)
+                                      GROUP BY type''')
+        else:
+            counts = self.conn.get('''SELECT type, COUNT(id)
+                                      FROM identifiers
+                                      GROUP BY type''')
+        for ident, count in counts:
             if count > 0:
                 categories['identifiers'].append(Tag(ident, count=count,
                                                  category='identifiers',
                                                  is_editable=False))
 
         if sort == 'popularity':
-            categories['identifiers'].sort(key=lambda x: x.count, reverse=True)
+            categories['identifiers'].sort(key=attrgetter('count'), reverse=True)
         else:  # no ratings exist to sort on
             # No need for ICU here.
-            categories['identifiers'].sort(key=lambda x:x.name)
+            categories['identifiers'].sort(key=attrgetter('name'))
 
         # ### Now do the user-defined categories. ####
         user_categories = dict.copy(self.clean_user_categories())
@@ -2111,7 +2167,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 continue
             user_categories[c] = []
             for sc in gst[c]:
-                if sc in list(categories.keys()):
+                if sc in categories:
                     for t in categories[sc]:
                         user_categories[c].append([t.name, sc, 0])
 
@@ -2142,13 +2198,13 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 icon_map[cat_name] = icon_map['user:']
             if sort == 'popularity':
                 categories[cat_name] = \
-                    sorted(items, key=lambda x: x.count, reverse=True)
+                    sorted(items, key=attrgetter('count'), reverse=True)
             elif sort == 'name':
                 categories[cat_name] = \
                     sorted(items, key=lambda x: sort_key(x.sort))
             else:
                 categories[cat_name] = \
-                    sorted(items, key=lambda x:x.avg_rating, reverse=True)
+                    sorted(items, key=attrgetter('avg_rating'), reverse=True)
 
         # ### Finally, the saved searches category ####
         items = []
@@ -2196,18 +2252,17 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         if mah is not None:
             mah = [x.replace(',', '|').lower() for x in mah]
             mah = ','.join(mah)
-        for r in self.data._data:
-            if r is not None:
-                if delta is None or (now - r[tindex]) > delta:
-                    if mah:
-                        authors = r[aindex] or ''
-                        if authors.lower() != mah:
-                            continue
-                    tags = r[gindex]
-                    if tags:
-                        tags = [x.strip() for x in tags.lower().split(',')]
-                        if tag in tags and (mht is None or mht in tags):
-                            yield r[iindex]
+        for r in self.data.iterall():
+            if delta is None or (now - r[tindex]) > delta:
+                if mah:
+                    authors = r[aindex] or ''
+                    if authors.lower() != mah:
+                        continue
+                tags = r[gindex]
+                if tags:
+                    tags = [x.strip() for x in tags.lower().split(',')]
+                    if tag in tags and (mht is None or mht in tags):
+                        yield r[iindex]
 
     def get_next_series_num_for(self, series):
         series_id = None
@@ -2233,30 +2288,45 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         Convenience method for setting the title, authors, publisher, tags or
         rating
         '''
-        id = self.data[row][0]
-        col = self.FIELD_MAP[column]
+        return self.set_many([(row, column, val)],
+                allow_case_change=allow_case_change)
 
-        books_to_refresh = {id}
-        set_args = (row, col, val)
-        if column == 'authors':
-            val = string_to_authors(val)
-            books_to_refresh |= self.set_authors(id, val, notify=False,
-                                                 allow_case_change=allow_case_change)
-        elif column == 'title':
-            self.set_title(id, val, notify=False)
-        elif column == 'publisher':
-            books_to_refresh |= self.set_publisher(id, val, notify=False,
-                                                   allow_case_change=allow_case_change)
-        elif column == 'rating':
-            self.set_rating(id, val, notify=False)
-        elif column == 'tags':
-            books_to_refresh |= \
-                self.set_tags(id, [x.strip() for x in val.split(',') if x.strip()],
-                    append=False, notify=False, allow_case_change=allow_case_change)
-        self.data.set(*set_args)
-        self.data.refresh_ids(self, [id])
-        self.set_path(id, True)
-        self.notify('metadata', [id])
+    def set_many(self, edits, allow_case_change=False):
+        '''
+        Same as :meth:`set` for a list of (row, column, val) edits. The
+        edits are committed together and the cache is refreshed, the book
+        paths are updated and listeners are notified only once, at the end.
+        '''
+        edits = [(row, self.data[row][0], column, self.FIELD_MAP[column], val)
+                 for row, column, val in edits]
+        books_to_refresh = set()
+        for row, id, column, col, val in edits:
+            books_to_refresh.add(id)
+            if column == 'authors':
+                self.windows_check_if_files_in_use(id)
+                books_to_refresh |= self._set_authors(id, string_to_authors(val),
+                                                      allow_case_change=allow_case_change)
+            elif column == 'title':
+                self.windows_check_if_files_in_use(id)
+                self._set_title(id, val)
+            elif column == 'publisher':
+                books_to_refresh |= self.set_publisher(id, val, notify=False, commit=False,
+                                                       allow_case_change=allow_case_change)
+            elif column == 'rating':
+                self.set_rating(id, val, notify=False, commit=False)
+            elif column == 'tags':
+                books_to_refresh |= \
+                    self.set_tags(id, [x.strip() for x in val.split(',') if x.strip()],
+                        append=False, notify=False, commit=False,
+                        allow_case_change=allow_case_change)
+            self.data.set(row, col, val)
+        self.dirtied(books_to_refresh, commit=False)
+        self.conn.commit()
+        ids = list(dict.fromkeys(e[1] for e in edits))
+        self.data.refresh_ids(self, ids)
+        for id in ids:
+            self.set_path(id, True)
+        self.notify('metadata', ids)
         return books_to_refresh
 
     def set_metadata(self, id, mi, ignore_errors=False, set_title=True,
@@ -2299,9 +2369,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         if set_authors:
             if not mi.authors:
                 mi.authors = [_('Unknown')]
-            authors = []
-            for a in mi.authors:
-                authors += string_to_authors(a)
+            authors = [x for a in mi.authors for x in string_to_authors(a)]
             self._set_authors(id, authors)
             path_changed = True
         if path_changed:
@@ -2455,13 +2523,11 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         self.conn.execute('DELETE FROM books_authors_link WHERE book=?',(id,))
         books_to_refresh = {id}
         final_authors = []
+        authors = [a if isinstance(a, unicode_type) else a.decode(preferred_encoding, 'replace')
+                   for a in authors if a]
         for a in authors:
             case_change = False
-            if not a:
-                continue
             a = a.strip().replace(',', '|')
-            if not isinstance(a, unicode_type):
-                a = a.decode(preferred_encoding, 'replace')
             aus = self.conn.get('SELECT id, name, sort FROM authors WHERE name=?', (a,))
             if aus:
                 aid, name, sort = aus[0]
@@ -2480,11 +2546,9 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 aid = self.conn.execute('''INSERT INTO authors(name)
                                            VALUES (?)''', (a,)).lastrowid
             final_authors.append(a.replace('|', ','))
-            try:
-                self.conn.execute('''INSERT INTO books_authors_link(book, author)
-                                     VALUES (?,?)''', (id, aid))
-            except IntegrityError:  # Sometimes books specify the same author twice in their metadata
-                pass
+            # Sometimes books specify the same author twice in their metadata
+            self.conn.execute('''INSERT OR IGNORE INTO books_authors_link(book, author)
+                                 VALUES (?,?)''', (id, aid))
             if case_change:
                 bks = self.conn.get('''SELECT book FROM books_authors_link
                                        WHERE author=?''', (aid,))
@@ -2589,9 +2653,9 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
     def set_languages(self, book_id, languages, notify=True, commit=True):
         self.conn.execute(
             'DELETE FROM books_languages_link WHERE book=?', (book_id,))
-        self.conn.execute('''DELETE FROM languages WHERE (SELECT COUNT(id)
+        self.conn.execute('''DELETE FROM languages WHERE NOT EXISTS (SELECT 1
                                  FROM books_languages_link WHERE
-                                 books_languages_link.lang_code=languages.id) < 1''')
+                                 books_languages_link.lang_code=languages.id)''')
 
         books_to_refresh = {book_id}
         final_languages = []
@@ -2671,9 +2735,9 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 bks = self.conn.get('''SELECT book FROM books_publishers_link
                                        WHERE publisher=?''', (aid,))
                 books_to_refresh |= {bk[0] for bk in bks}
-        self.conn.execute('''DELETE FROM publishers WHERE (SELECT COUNT(id)
+        self.conn.execute('''DELETE FROM publishers WHERE NOT EXISTS (SELECT 1
                              FROM books_publishers_link
-                             WHERE publisher=publishers.id) < 1''')
+                             WHERE publisher=publishers.id)''')
 
         self.dirtied({id}|books_to_refresh, commit=False)
         if commit:
@@ -3088,38 +3152,41 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
         otags = self.get_tags(id)
         tags = self.cleanup_tags(tags)
         books_to_refresh = {id}
-        for tag in (set(tags)-otags):
+        new_tags = set(tags) - otags
+        # Read the existing tags once, rather than once for every new tag, and
+        # only when there are new tags to look up
+        existing_tags = {}
+        if new_tags:
+            for tid, name in self.conn.get('SELECT id, name FROM tags'):
+                name = name.strip()
+                if name:
+                    existing_tags.setdefault(name.lower(), (tid, name))
+        for tag in new_tags:
             case_changed = False
             tag = tag.strip()
             if not tag:
                 continue
             if not isinstance(tag, unicode_type):
                 tag = tag.decode(preferred_encoding, 'replace')
-            existing_tags = self.all_tags()
-            lt = [t.lower() for t in existing_tags]
-            try:
-                idx = lt.index(tag.lower())
-            except ValueError:
-                idx = -1
-            if idx > -1:
-                etag = existing_tags[idx]
-                tid = self.conn.get('SELECT id FROM tags WHERE name=?', (etag,), all=False)
-                if allow_case_change and etag != tag:
+            etag = existing_tags.get(tag.lower())
+            if etag is not None:
+                tid, ename = etag
+                if allow_case_change and ename != tag:
                     self.conn.execute('UPDATE tags SET name=? WHERE id=?', (tag, tid))
                     case_changed = True
             else:
                 tid = self.conn.execute('INSERT INTO tags(name) VALUES(?)', (tag,)).lastrowid
+                existing_tags[tag.lower()] = (tid, tag)
 
-            if not self.conn.get('''SELECT book FROM books_tags_link
-                                    WHERE book=? AND tag=?''', (id, tid), all=False):
-                self.conn.execute('''INSERT INTO books_tags_link(book, tag)
-                                     VALUES (?,?)''', (id, tid))
+            # The UNIQUE(book, tag) constraint takes care of existing links
+            self.conn.execute('''INSERT OR IGNORE INTO books_tags_link(book, tag)
+                                 VALUES (?,?)''', (id, tid))
             if case_changed:
                 bks = self.conn.get('SELECT book FROM books_tags_link WHERE tag=?',
                                         (tid,))
                 books_to_refresh |= {bk[0] for bk in bks}
-        self.conn.execute('''DELETE FROM tags WHERE (SELECT COUNT(id)
-                                FROM books_tags_link WHERE tag=tags.id) < 1''')
+        self.conn.execute('''DELETE FROM tags WHERE NOT EXISTS (SELECT 1
+                                FROM books_tags_link WHERE tag=tags.id)''')
         self.dirtied({id}|books_to_refresh, commit=False)
         if commit:
             self.conn.commit()
@@ -3198,8 +3265,8 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                                         (aid,))
                 books_to_refresh |= {bk[0] for bk in bks}
         self.conn.execute('''DELETE FROM series
-                             WHERE (SELECT COUNT(id) FROM books_series_link
-                                    WHERE series=series.id) < 1''')
+                             WHERE NOT EXISTS (SELECT 1 FROM books_series_link
+                                    WHERE series=series.id)''')
         self.dirtied([id], commit=False)
         if commit:
             self.conn.commit()
@@ -3263,7 +3330,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
             self.notify('metadata', [id])
 
     def isbn(self, idx, index_is_id=False):
-        row = self.data._data[idx] if index_is_id else self.data[idx]
+        row = self.data._data.get(idx) if index_is_id else self.data[idx]
         if row is not None:
             raw = row[self.FIELD_MAP['identifiers']]
             if raw:
@@ -3273,7 +3340,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
 
     def get_identifiers(self, idx, index_is_id=False):
         ans = {}
-        row = self.data._data[idx] if index_is_id else self.data[idx]
+        row = self.data._data.get(idx) if index_is_id else self.data[idx]
         if row is not None:
             raw = row[self.FIELD_MAP['identifiers']]
             if raw:
@@ -3362,7 +3429,8 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                                     (title, 'calibre'))
                 db_id = obj.lastrowid
                 self.data.books_added([db_id], self)
-                self.set_path(db_id, index_is_id=True)
+                # The path is set by set_metadata() below, once the title
+                # and authors are known
                 self.conn.commit()
             try:
                 mi = get_metadata(stream, format)
@@ -3404,7 +3472,8 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                               (mi.title, mi.authors[0]))
         id = obj.lastrowid
         self.data.books_added([id], self)
-        self.set_path(id, index_is_id=True)
+        # The path is set by set_metadata() below, once the title and authors
+        # are known
         self.conn.commit()
         if mi.pubdate is None:
             mi.pubdate = utcnow()
@@ -3513,14 +3582,17 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 mi.timestamp = utcnow()
             if mi.pubdate is None:
                 mi.pubdate = UNDEFINED_DATE
-            self.set_metadata(id, mi, commit=True, ignore_errors=True)
+            # Everything is committed once, after all books have been added
+            self.set_metadata(id, mi, commit=False, ignore_errors=True)
             npath = self.run_import_plugins(path, format)
             format = os.path.splitext(npath)[-1].lower().replace('.', '').upper()
             with lopen(npath, 'rb') as stream:
                 format = check_ebook_format(stream, format)
-                self.add_format(id, format, stream, index_is_id=True)
+                self.add_format(id, format, stream, index_is_id=True,
+                        commit=False)
             postimport.append((id, format))
         self.conn.commit()
+        self.categories_cache.clear()
         self.data.refresh_ids(self, ids)  # Needed to update format list and size
         for book_id, fmt in postimport:
             run_plugins_on_postimport(self, book_id, fmt)
@@ -3578,11 +3650,10 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
 
     def get_top_level_move_items(self):
         items = set(os.listdir(self.library_path))
-        paths = set()
-        for x in self.data.universal_set():
-            path = self.path(x, index_is_id=True)
-            path = path.split(os.sep)[0]
-            paths.add(path)
+        # Many books share an author directory, collect each one only once.
+        # Paths are stored with / as the separator.
+        pidx = self.FIELD_MAP['path']
+        paths = {r[pidx].partition('/')[0] for r in self.data.iterall()}
         paths.update({'metadata.db', 'metadata_db_prefs_backup.json'})
         path_map = {}
         for x in paths:
@@ -3602,23 +3673,49 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
             os.makedirs(newloc)
         old_dirs = set()
         items, path_map = self.get_top_level_move_items()
-        for x in items:
+
+        def copy_item(x):
             src = os.path.join(self.library_path, x)
             dest = os.path.join(newloc, path_map[x])
             if os.path.isdir(src):
                 if os.path.exists(dest):
                     shutil.rmtree(dest)
                 shutil.copytree(src, dest)
-                old_dirs.add(src)
-            else:
-                if os.path.exists(dest):
-                    os.remove(dest)
-                shutil.copyfile(src, dest)
+                return x, src
+            if os.path.exists(dest):
+                os.remove(dest)
+            shutil.copyfile(src, dest)
+            return x, None
+
+        def copied(future):
+            x, old_dir = future.result()
+            if old_dir is not None:
+                old_dirs.add(old_dir)
             x = path_map[x]
             if not isinstance(x, unicode_type):
                 x = x.decode(filesystem_encoding, 'replace')
             progress(x)
 
+        # Copying is I/O bound, so copy several top level items at a time.
+        # Items are only submitted as earlier ones finish, and the ones not
+        # yet started are cancelled if a copy fails, so that a failure stops
+        # the move as it did when copying one item at a time. Results are
+        # handled in order and progress is reported from this thread.
+        workers = 4
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                for x in items:
+                    pending.append(pool.submit(copy_item, x))
+                    if len(pending) >= workers:
+                        copied(pending.popleft())
+                while pending:
+                    copied(pending.popleft())
+            except:
+                for future in pending:
+                    future.cancel()
+                raise
+
         dbpath = os.path.join(newloc, os.path.basename(self.dbpath))
         opath = self.dbpath
         self.conn.close()
@@ -3635,9 +3732,7 @@ class LibraryDatabase2(LibraryDatabase, SchemaUpgrade, CustomColumns):
                 pass
 
     def __iter__(self):
-        for record in self.data._data:
-            if record is not None:
-                yield record
+        return self.data.iterall()
 
     def all_ids(self):
         x = self.FIELD_MAP['id']
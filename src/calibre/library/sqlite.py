@@ -251,9 +251,21 @@ def load_c_extensions(conn, debug=DEBUG):
     return False
 
 
+# Same as the busy timeout used by calibre.db.backend
+BUSY_TIMEOUT = 10  # seconds
+
+
 def do_connect(path, row_factory=None):
-    conn = sqlite.connect(path, factory=Connection)
+    # The legacy code interpolates table names into many of its statements,
+    # so keep more prepared statements around than the default of 128.
+    #
+    # Implicit transactions are started with BEGIN IMMEDIATE, so that the
+    # write lock is always taken by the BEGIN itself
+    conn = sqlite.connect(path, factory=Connection, timeout=BUSY_TIMEOUT,
+                          cached_statements=256, isolation_level='IMMEDIATE')
     conn.execute('pragma cache_size=-5000')
+    # Store temporary tables in memory
+    conn.execute('pragma temp_store=2')
     encoding = conn.execute('pragma encoding').fetchone()[0]
     conn.create_aggregate('sortconcat', 2, SortedConcatenate)
     conn.create_aggregate('sortconcat_bar', 2, SortedConcatenateBar)